@@ -0,0 +1,129 @@
+"""
+Batched UDP receive using Linux recvmmsg(2).
+
+The watch and phone apps each send one small JSON datagram per sensor event,
+so calling recvfrom() once per packet means one syscall per packet. recvmmsg()
+pulls up to `batch_size` queued datagrams in a single call.
+
+All ctypes structures and receive buffers are allocated once in __init__;
+nothing is allocated per call except the returned bytes objects.
+
+On platforms without recvmmsg (macOS, Windows) `available` is False and
+recv_batch() always returns an empty list, so callers fall back to recvfrom().
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import socket
+import sys
+
+MSG_DONTWAIT = 0x40
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", _MsgHdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+class _SockAddrIn(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),  # network byte order
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8),
+    ]
+
+
+def _load_recvmmsg():
+    """Return libc's recvmmsg function, or None if the platform lacks it"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fn = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint,
+                   ctypes.c_int, ctypes.c_void_p]
+    fn.restype = ctypes.c_int
+    return fn
+
+
+_recvmmsg = _load_recvmmsg()
+
+
+class BatchReceiver:
+    """Drain up to `batch_size` datagrams from an IPv4 UDP socket per syscall"""
+
+    def __init__(self, sock, batch_size=64, bufsize=4096):
+        self.sock = sock
+        self.batch_size = batch_size
+        self.available = _recvmmsg is not None and sock.family == socket.AF_INET
+
+        if not self.available:
+            return
+
+        # Pre-allocate every buffer and header once
+        self._bufs = [ctypes.create_string_buffer(bufsize) for _ in range(batch_size)]
+        self._iovs = (_IOVec * batch_size)()
+        self._addrs = (_SockAddrIn * batch_size)()
+        self._msgs = (_MMsgHdr * batch_size)()
+        self._addr_len = ctypes.sizeof(_SockAddrIn)
+
+        for i in range(batch_size):
+            self._iovs[i].iov_base = ctypes.addressof(self._bufs[i])
+            self._iovs[i].iov_len = bufsize
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._addrs[i])
+            hdr.msg_namelen = self._addr_len
+            hdr.msg_iov = ctypes.pointer(self._iovs[i])
+            hdr.msg_iovlen = 1
+
+    def recv_batch(self):
+        """
+        Return a list of (data, (ip, port)) for every datagram currently queued
+        (at most batch_size). Never blocks; returns [] when nothing is queued.
+        """
+        if not self.available:
+            return []
+
+        n = _recvmmsg(self.sock.fileno(), self._msgs, self.batch_size, MSG_DONTWAIT, None)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(err, f"recvmmsg failed: {errno.errorcode.get(err, err)}")
+
+        batch = []
+        for i in range(n):
+            msg = self._msgs[i]
+            addr = self._addrs[i]
+            ip = '.'.join(str(b) for b in addr.sin_addr)
+            port = socket.ntohs(addr.sin_port)
+            batch.append((ctypes.string_at(self._bufs[i], msg.msg_len), (ip, port)))
+            # msg_namelen is value-result; reset it for the next call
+            msg.msg_hdr.msg_namelen = self._addr_len
+
+        return batch
@@ -4,10 +4,14 @@ Button Data Collector - Python Backend
 Receives UDP label events from Android button grid app and saves labeled sensor data.
 
 Usage:
-    python button_data_collector.py [--skip-noise]
+    python button_data_collector.py [--skip-noise] [--pin-cpu [N]]
 
 Options:
     --skip-noise    Skip baseline noise capture (for testing)
+    --pin-cpu [N]   Linux only: pin the UDP receive thread to CPU N (default 2)
+                    and run it with SCHED_FIFO priority (needs root or
+                    CAP_SYS_NICE for the priority part). For lossless capture
+                    also enlarge the NIC ring: sudo ethtool -G <iface> rx 4096
 
 Requirements:
     - Watch app streaming sensor data on port 12345
@@ -28,37 +32,244 @@ IMPORTANT: Data Format
 """
 
 import json
+import os
+import random
+import selectors
 import socket
 import threading
 import time
 import sys
-from collections import deque
 from datetime import datetime
 from pathlib import Path
-import csv
+
+import numpy as np
+import orjson
+
+from batch_recv import BatchReceiver
+
+
+# ANSI Colors for terminal
+class Colors:
+    YELLOW = "\033[93m"
+    RESET = "\033[0m"
+
+
+# Requested kernel socket receive buffer (4 MiB); net.core.rmem_max must be at
+# least this, which start() checks against the size actually granted
+RCVBUF_BYTES = 4 << 20
+
+# Sensor channels, in the column order of the sample value arrays
+CHANNELS = (
+    'accel_x', 'accel_y', 'accel_z',
+    'gyro_x', 'gyro_y', 'gyro_z',
+    'rot_x', 'rot_y', 'rot_z', 'rot_w'
+)
+CHANNEL_INDEX = {name: i for i, name in enumerate(CHANNELS)}
+
+# Ring buffer length: power of two (~40 seconds at 50Hz) so a mask replaces %
+RING_N = 2048
+RING_MASK = RING_N - 1
+
+# Noise segments kept per classifier, and their lengths at 50Hz
+NOISE_SEGMENTS = 30
+LOCOMOTION_SEGMENT = int(5.0 * 50)
+ACTION_SEGMENT = int(1.0 * 50)
+
+# Receive thread pinning (--pin-cpu): CPU 0 usually services NIC interrupts
+DEFAULT_PIN_CPU = 2
+RECEIVE_FIFO_PRIORITY = 10
+
+# Capacity of the receiver -> writer job ring (power of two)
+WRITE_RING_N = 64
+
+# CSV column orders ('timestamp', 'sensor' or a channel name)
+RECORDING_COLUMNS = (
+    'accel_x', 'accel_y', 'accel_z',
+    'gyro_x', 'gyro_y', 'gyro_z',
+    'rot_w', 'rot_x', 'rot_y', 'rot_z',
+    'sensor', 'timestamp'
+)
+BASELINE_COLUMNS = (
+    'timestamp', 'sensor',
+    'accel_x', 'accel_y', 'accel_z',
+    'gyro_x', 'gyro_y', 'gyro_z',
+    'rot_x', 'rot_y', 'rot_z', 'rot_w'
+)
+# All selected noise segments go into one file, tagged per row
+NOISE_SEGMENT_COLUMNS = ('segment_id', 'classifier_type') + RECORDING_COLUMNS
+NOISE_SEGMENTS_FILE = "noise_segments.csv"
+# Precomputed CSV header line for each column order
+HEADER_BYTES = {
+    columns: (','.join(columns) + '\n').encode('ascii')
+    for columns in (RECORDING_COLUMNS, BASELINE_COLUMNS, NOISE_SEGMENT_COLUMNS)
+}
+
+# Limits of the alloc_samples dtypes: sensor codes are uint8, timestamps int64
+MAX_SENSOR_CODES = 256
+TIMESTAMP_MIN = -(1 << 63)
+TIMESTAMP_MAX = (1 << 63) - 1
+
+
+def parse_json(data):
+    """
+    Parse a datagram with orjson, or return None if it is not valid JSON.
+    orjson rejects NaN/Infinity, which the watch app sends for NaN floats
+    ("${values[0]}"), so those packets fall back to the stdlib parser.
+    """
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        pass
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+def default_route_interfaces():
+    """Names of the (non-loopback) interfaces with an IPv4 default route; [] if unknown"""
+    try:
+        with open('/proc/net/route', 'r', encoding='utf-8') as f:
+            rows = [line.split() for line in f.readlines()[1:]]
+    except OSError:
+        return []  # Not Linux
+    return sorted({row[0] for row in rows
+                   if len(row) > 1 and row[1] == '00000000' and row[0] != 'lo'})
+
+
+def csv_field(text):
+    """Encode text as one CSV field, quoted like csv.writer's QUOTE_MINIMAL"""
+    if any(c in text for c in ',"\r\n'):
+        text = '"' + text.replace('"', '""') + '"'
+    return text.encode('utf-8')
+
+
+def alloc_samples(n):
+    """
+    Allocate struct-of-arrays storage for n sensor samples.
+    Returns (timestamps_ns, sensor_codes, values) where values has one column per channel.
+    """
+    return (
+        np.empty(n, dtype=np.int64),
+        np.empty(n, dtype=np.uint8),
+        np.empty((n, len(CHANNELS)), dtype=np.float64),
+    )
+
+
+class SpscRing:
+    """
+    Lock-free single-producer/single-consumer ring with power-of-two capacity.
+
+    head is only advanced by the producer and tail only by the consumer, so the
+    slots need no lock. A threading.Event wakes the consumer when it is idle; the
+    producer only sets it (which takes the Event's internal lock) while the
+    consumer has flagged itself as waiting.
+    """
+
+    def __init__(self, capacity):
+        assert capacity & (capacity - 1) == 0, "capacity must be a power of two"
+        self.slots = [None] * capacity
+        self.mask = capacity - 1
+        self.head = 0  # next slot to write (producer only)
+        self.tail = 0  # next slot to read (consumer only)
+        self.ready = threading.Event()
+        self.waiting = False  # consumer is blocked (or about to block) on ready
+
+    def push(self, item):
+        """Producer: append item, waiting for the consumer if the ring is full"""
+        while self.head - self.tail > self.mask:
+            time.sleep(0.001)
+        self.slots[self.head & self.mask] = item
+        self.head += 1
+        if self.waiting:
+            self.ready.set()
+
+    def pop(self):
+        """Consumer: remove and return the oldest item, blocking until one exists"""
+        while self.tail == self.head:
+            self.ready.clear()
+            self.waiting = True
+            # Re-check after raising the flag so a push racing with it is not missed
+            if self.tail == self.head:
+                self.ready.wait()
+            self.waiting = False
+
+        slot = self.tail & self.mask
+        item = self.slots[slot]
+        self.slots[slot] = None
+        self.tail += 1
+        return item
+
+
+class SegmentReservoir:
+    """
+    Uniform random sample of k fixed-size segments from a stream (Algorithm R).
+    Slots are preallocated, so memory is O(k * segment_size) regardless of session length.
+    """
+
+    def __init__(self, k, segment_size):
+        self.k = k
+        self.slots = [alloc_samples(segment_size) for _ in range(k)]
+        self.seen = 0
+
+    def offer(self, segment):
+        """Consider one (ts, sensor, values) segment; it is copied if selected"""
+        j = self.seen if self.seen < self.k else random.randint(0, self.seen)
+        self.seen += 1
+        if j < self.k:
+            for dst, src in zip(self.slots[j], segment):
+                dst[:] = src
+
+    def segments(self):
+        """Currently selected segments (all of them while fewer than k were seen)"""
+        return self.slots[:min(self.seen, self.k)]
 
 
 class ButtonDataCollector:
-    def __init__(self, udp_port=12345, output_dir="data/button_collected", skip_noise=False):
+    def __init__(self, udp_port=12345, output_dir="data/button_collected", skip_noise=False,
+                 pin_cpu=None):
         self.udp_port = udp_port
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.skip_noise = skip_noise
+        self.pin_cpu = pin_cpu  # None = leave scheduling to the OS
+
+        # Fixed-capacity circular buffer for sensor data (last RING_N samples)
+        # Sample i lives at slot i & RING_MASK; widx counts every sample ever written
+        self.ring_ts, self.ring_sensor, self.ring = alloc_samples(RING_N)
+        self.widx = 0
 
-        # Buffer for sensor data (keep last 30 seconds at 50Hz = 1500 samples)
-        self.sensor_buffer = deque(maxlen=1500)
+        # Sensor names are stored as small integer codes (index into sensor_names)
+        self.sensor_names = []
+        self.sensor_codes = {}
 
         # Currently recording action (None means NOISE mode - default state)
         self.active_recording = None
 
-        # Noise capture
-        self.noise_buffer = []
+        # Noise capture: samples fill a 5s block; each full block is offered to
+        # the locomotion reservoir and, split into 1s chunks, to the action reservoir
+        self.noise_ts, self.noise_sensor, self.noise_values = alloc_samples(LOCOMOTION_SEGMENT)
+        self.noise_pending = 0
+        self.noise_count = 0
+        self.locomotion_reservoir = SegmentReservoir(NOISE_SEGMENTS, LOCOMOTION_SEGMENT)
+        self.action_reservoir = SegmentReservoir(NOISE_SEGMENTS, ACTION_SEGMENT)
+
+        # Baseline noise (growable arrays, only used during the baseline window)
+        self.baseline_ts, self.baseline_sensor, self.baseline_values = alloc_samples(RING_N)
+        self.baseline_count = 0
         self.baseline_noise_captured = skip_noise  # Skip if flag set
         self.baseline_noise_duration = 30  # seconds
         self.noise_start_time = time.time()  # Initialize immediately
 
-        # Lock for thread safety
-        self.lock = threading.Lock()
+        # Threading invariant: all collector state (buffers, active_recording,
+        # counters) is only touched by the receive thread, so it needs no lock.
+        # CSV writes are queued as (filepath, columns, samples, extra, sensor_names)
+        # and performed by a background writer thread so the UDP receive loop never
+        # blocks on disk.
+        # The writer only sees snapshots handed over through write_ring; the receive
+        # thread is its only producer and the writer its only consumer.
+        self.write_ring = SpscRing(WRITE_RING_N)
+        self.writer_thread = None
 
         # Statistics
         self.action_counts = {
@@ -71,6 +282,12 @@ class ButtonDataCollector:
         self.session_start = datetime.now()
         self.total_recordings = 0
 
+        # Message type -> handler, used by handle_message
+        self._dispatch = {
+            'label_event': self.handle_label_event,
+            'sensor': self._handle_sensor,
+        }
+
         # Connection tracking
         self.watch_connected = False
         self.phone_connected = False
@@ -89,25 +306,48 @@ class ButtonDataCollector:
         print(f"   📱 Watch app: Waiting...")
         print(f"   📲 Phone app: Waiting...")
 
+        self._check_kernel_tuning()
+
         # Create UDP socket
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        # Enlarge the kernel receive buffer so bursts survive file writes / GC pauses
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_BYTES)
+        except OSError as e:
+            print(f"   ⚠️  Could not set SO_RCVBUF: {e}")
+        rcvbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if sys.platform.startswith('linux'):
+            rcvbuf //= 2  # Linux reports double the size (it includes bookkeeping overhead)
+        print(f"📦 UDP receive buffer: {rcvbuf // 1024} KiB")
+        if rcvbuf < RCVBUF_BYTES:
+            # Linux silently caps SO_RCVBUF at net.core.rmem_max
+            print(f"   ⚠️  Kernel capped the receive buffer (requested {RCVBUF_BYTES // 1024} KiB)")
+            print(f"   💡 Raise the limit with: sudo sysctl -w net.core.rmem_max={RCVBUF_BYTES}")
+
         sock.bind(('0.0.0.0', self.udp_port))
         sock.settimeout(0.5)  # Non-blocking with timeout
 
         ready_to_start = False
+        sel = selectors.DefaultSelector()
+
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+
+        # Pin after starting the writer so it does not inherit the affinity
+        if self.pin_cpu is not None:
+            self._pin_receive_thread(self.pin_cpu)
 
         try:
             # Wait for both connections before starting
             while not ready_to_start:
                 try:
                     data, addr = sock.recvfrom(4096)
-                    message = data.decode('utf-8')
-
-                    # Parse JSON message
-                    try:
-                        msg = json.loads(message)
 
+                    # Parse JSON message (orjson takes the raw bytes directly)
+                    msg = parse_json(data)
+                    if isinstance(msg, dict):
                         # Check message type
                         if msg.get('sensor'):
                             # Sensor data from watch
@@ -150,9 +390,6 @@ class ButtonDataCollector:
                             ready_to_start = True
                             self.noise_start_time = time.time()
 
-                    except json.JSONDecodeError:
-                        pass
-
                 except socket.timeout:
                     # Check connection health
                     current_time = time.time()
@@ -165,139 +402,233 @@ class ButtonDataCollector:
                     continue
 
             # Main collection loop
+            # Non-blocking socket + selector: on every wakeup, drain all queued
+            # datagrams (recvmmsg, up to 64 per syscall, where available) before
+            # going back to select()
+            sock.setblocking(False)
+            sel.register(sock, selectors.EVENT_READ)
+            receiver = BatchReceiver(sock, batch_size=64, bufsize=4096)
             while True:
-                try:
-                    data, addr = sock.recvfrom(4096)
-                    message = data.decode('utf-8')
+                if not sel.select(timeout=0.5):
+                    continue
 
-                    # Parse JSON message
-                    try:
-                        msg = json.loads(message)
-                        self.handle_message(msg, addr)
-                    except json.JSONDecodeError:
-                        pass
+                while True:
+                    batch = receiver.recv_batch()
+                    if not batch:
+                        if receiver.available:
+                            break  # recvmmsg already found the queue empty
+                        try:
+                            batch = [sock.recvfrom(4096)]
+                        except BlockingIOError:
+                            break
 
-                except socket.timeout:
-                    continue
+                    for data, addr in batch:
+                        self.handle_datagram(data, addr)
 
         except KeyboardInterrupt:
             print("\n\n🛑 Stopping data collector...")
             if not self.skip_noise:
                 self.segment_and_save_noise()
+            self.stop_writer()
             self.print_statistics()
         finally:
+            self.stop_writer()
+            sel.close()
             sock.close()
 
+    def _check_kernel_tuning(self):
+        """Warn if reverse-path filtering could drop UDP packets arriving on the LAN interface"""
+        # The kernel applies max(conf/all, conf/<iface>), so check 'all' plus the
+        # interface(s) holding the default route, which carry the watch/phone traffic
+        for iface in ['all'] + default_route_interfaces():
+            try:
+                with open(f'/proc/sys/net/ipv4/conf/{iface}/rp_filter', 'r', encoding='utf-8') as f:
+                    value = int(f.read().strip())
+            except (OSError, ValueError):
+                continue  # Not Linux, or not readable
+
+            if value != 0:
+                # Slash form, since interface names may contain dots (e.g. eth0.100)
+                name = f'net/ipv4/conf/{iface}/rp_filter'
+                print(f"{Colors.YELLOW}   ⚠️  {name} = {value} (recommended: 0){Colors.RESET}")
+                print(f"{Colors.YELLOW}   💡 Fix with: sudo sysctl -w {name}=0{Colors.RESET}")
+
+    def _pin_receive_thread(self, cpu_id):
+        """Pin the calling (receive) thread to one CPU and give it real-time priority"""
+        if not hasattr(os, 'sched_setaffinity'):
+            print(f"   ⚠️  CPU pinning is not supported on this platform")
+            return
+
+        # On Linux, pid 0 applies to the calling thread only
+        try:
+            os.sched_setaffinity(0, {cpu_id})
+            print(f"📌 Receive thread pinned to CPU {cpu_id}")
+        except OSError as e:
+            print(f"   ⚠️  Could not pin receive thread to CPU {cpu_id}: {e}")
+
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(RECEIVE_FIFO_PRIORITY))
+            print(f"⚡ Receive thread running with SCHED_FIFO priority {RECEIVE_FIFO_PRIORITY}")
+        except (OSError, AttributeError) as e:
+            print(f"   ⚠️  Could not set SCHED_FIFO (run as root or grant CAP_SYS_NICE): {e}")
+
+    def handle_datagram(self, data, addr):
+        """Handle one raw UDP datagram"""
+        # Parse JSON message (orjson takes the raw bytes directly)
+        msg = parse_json(data)
+        if not isinstance(msg, dict):
+            return  # Invalid JSON, or not an object
+        self.handle_message(msg, addr)
+
     def handle_message(self, msg, addr):
         """Handle incoming UDP message"""
+        # Label events carry a 'type'; watch packets only have a 'sensor' field
+        # Only string types can be dispatched (lists/objects are unhashable)
         msg_type = msg.get('type')
-
-        if msg_type == 'label_event':
-            self.handle_label_event(msg, addr)
-        elif msg.get('sensor'):
-            # Sensor data - parse and buffer
-            self.last_watch_data = time.time()
-
-            # Parse sensor values (handle both formats)
-            # Note: Each packet contains ONE sensor type, not all three!
-            # We store each sensor reading separately with its timestamp
-            values = msg.get('values', {})
-            sensor_type = msg.get('sensor', 'unknown')
-            timestamp = msg.get('timestamp_ns', msg.get('timestamp', time.time() * 1e9))
-
-            # Initialize all sensor values to 0 (only the relevant sensor will have data)
-            accel_x = accel_y = accel_z = 0.0
-            gyro_x = gyro_y = gyro_z = 0.0
-            rot_x = rot_y = rot_z = 0.0
-            rot_w = 1.0
-
-            # Extract values based on sensor type
-            if sensor_type == 'linear_acceleration':
-                accel_x = values.get('x', msg.get('accel_x', 0.0))
-                accel_y = values.get('y', msg.get('accel_y', 0.0))
-                accel_z = values.get('z', msg.get('accel_z', 0.0))
-            elif sensor_type == 'gyroscope':
-                gyro_x = values.get('x', msg.get('gyro_x', 0.0))
-                gyro_y = values.get('y', msg.get('gyro_y', 0.0))
-                gyro_z = values.get('z', msg.get('gyro_z', 0.0))
-            elif sensor_type == 'rotation_vector':
-                rot_x = values.get('x', msg.get('rot_x', 0.0))
-                rot_y = values.get('y', msg.get('rot_y', 0.0))
-                rot_z = values.get('z', msg.get('rot_z', 0.0))
-                rot_w = values.get('w', msg.get('rot_w', 1.0))
+        if not isinstance(msg_type, str):
+            msg_type = None
+        handler = self._dispatch.get(msg_type or ('sensor' if msg.get('sensor') else None))
+        if handler:
+            handler(msg, addr)
+
+    def _handle_sensor(self, msg, addr):
+        """Parse a JSON sensor packet and buffer it"""
+        # Parse sensor values (handle both formats)
+        # Note: Each packet contains ONE sensor type, not all three!
+        # We store each sensor reading separately with its timestamp
+        values = msg.get('values', {})
+        if not isinstance(values, dict):
+            return
+        # Coerce to str as csv.writer did; the name is later encoded and used as a dict key
+        sensor_type = str(msg.get('sensor', 'unknown'))
+        timestamp = msg.get('timestamp_ns', msg.get('timestamp', time.time_ns()))
+
+        # Initialize all sensor values to 0 (only the relevant sensor will have data)
+        accel_x = accel_y = accel_z = 0.0
+        gyro_x = gyro_y = gyro_z = 0.0
+        rot_x = rot_y = rot_z = 0.0
+        rot_w = 1.0
+
+        # Extract values based on sensor type
+        if sensor_type == 'linear_acceleration':
+            accel_x = values.get('x', msg.get('accel_x', 0.0))
+            accel_y = values.get('y', msg.get('accel_y', 0.0))
+            accel_z = values.get('z', msg.get('accel_z', 0.0))
+        elif sensor_type == 'gyroscope':
+            gyro_x = values.get('x', msg.get('gyro_x', 0.0))
+            gyro_y = values.get('y', msg.get('gyro_y', 0.0))
+            gyro_z = values.get('z', msg.get('gyro_z', 0.0))
+        elif sensor_type == 'rotation_vector':
+            rot_x = values.get('x', msg.get('rot_x', 0.0))
+            rot_y = values.get('y', msg.get('rot_y', 0.0))
+            rot_z = values.get('z', msg.get('rot_z', 0.0))
+            rot_w = values.get('w', msg.get('rot_w', 1.0))
+        else:
+            # Fallback to flat format (old watch app)
+            accel_x = msg.get('accel_x', 0.0)
+            accel_y = msg.get('accel_y', 0.0)
+            accel_z = msg.get('accel_z', 0.0)
+            gyro_x = msg.get('gyro_x', 0.0)
+            gyro_y = msg.get('gyro_y', 0.0)
+            gyro_z = msg.get('gyro_z', 0.0)
+            rot_x = msg.get('rot_x', 0.0)
+            rot_y = msg.get('rot_y', 0.0)
+            rot_z = msg.get('rot_z', 0.0)
+            rot_w = msg.get('rot_w', 1.0)
+
+        # Validate once at insertion so buffered samples never need re-checking:
+        # the NumPy buffers need an int64 timestamp and numeric values
+        try:
+            timestamp = int(timestamp)
+            if not TIMESTAMP_MIN <= timestamp <= TIMESTAMP_MAX:
+                return
+            row = tuple(float(v) for v in (accel_x, accel_y, accel_z,
+                                           gyro_x, gyro_y, gyro_z,
+                                           rot_x, rot_y, rot_z, rot_w))
+        except (TypeError, ValueError, OverflowError):
+            return
+        self._store_sample(sensor_type, timestamp, row)
+
+    def _store_sample(self, sensor_type, timestamp, row):
+        """Buffer one parsed sensor reading (row is ordered like CHANNELS)"""
+        code = self.sensor_codes.get(sensor_type)
+        if code is None:
+            if len(self.sensor_names) >= MAX_SENSOR_CODES:
+                return  # uint8 codes are exhausted; drop the sample
+            code = self.sensor_codes[sensor_type] = len(self.sensor_names)
+            self.sensor_names.append(sensor_type)
+
+        self.last_watch_data = time.time()
+
+        # Add to main ring buffer
+        slot = self.widx & RING_MASK
+        self.ring_ts[slot] = timestamp
+        self.ring_sensor[slot] = code
+        self.ring[slot] = row
+        self.widx += 1
+
+        # Capture baseline noise (first 30 seconds after noise_start_time)
+        if not self.baseline_noise_captured and self.noise_start_time:
+            elapsed = time.time() - self.noise_start_time
+            if elapsed <= self.baseline_noise_duration:
+                # Still in baseline capture window
+                self._append_baseline(timestamp, code, row)
+                self._append_noise(timestamp, code, row)
+
+                # Print progress every 5 seconds
+                if int(elapsed) % 5 == 0 and self.noise_count % 250 == 0:
+                    print(f"   📊 Baseline: {int(elapsed)}s / {self.baseline_noise_duration}s ({self.noise_count} samples)")
             else:
-                # Fallback to flat format (old watch app)
-                accel_x = msg.get('accel_x', 0.0)
-                accel_y = msg.get('accel_y', 0.0)
-                accel_z = msg.get('accel_z', 0.0)
-                gyro_x = msg.get('gyro_x', 0.0)
-                gyro_y = msg.get('gyro_y', 0.0)
-                gyro_z = msg.get('gyro_z', 0.0)
-                rot_x = msg.get('rot_x', 0.0)
-                rot_y = msg.get('rot_y', 0.0)
-                rot_z = msg.get('rot_z', 0.0)
-                rot_w = msg.get('rot_w', 1.0)
-
-            sensor_entry = {
-                'timestamp': timestamp,
-                'sensor': sensor_type,
-                'accel_x': accel_x,
-                'accel_y': accel_y,
-                'accel_z': accel_z,
-                'gyro_x': gyro_x,
-                'gyro_y': gyro_y,
-                'gyro_z': gyro_z,
-                'rot_x': rot_x,
-                'rot_y': rot_y,
-                'rot_z': rot_z,
-                'rot_w': rot_w
-            }
-
-            # Add to main buffer
-            with self.lock:
-                self.sensor_buffer.append(sensor_entry)
-
-            # Capture baseline noise (first 30 seconds after noise_start_time)
-            if not self.baseline_noise_captured and self.noise_start_time:
-                elapsed = time.time() - self.noise_start_time
-                if elapsed <= self.baseline_noise_duration:
-                    # Still in baseline capture window
-                    self.noise_buffer.append(sensor_entry)
-
-                    # Print progress every 5 seconds
-                    if int(elapsed) % 5 == 0 and len(self.noise_buffer) % 250 == 0:
-                        print(f"   📊 Baseline: {int(elapsed)}s / {self.baseline_noise_duration}s ({len(self.noise_buffer)} samples)")
-                else:
-                    # Baseline complete - save noise data immediately
-                    self.baseline_noise_captured = True
-                    samples = len(self.noise_buffer)
-                    print(f"✅ Baseline noise captured ({samples} samples)")
-
-                    # Save baseline noise to file immediately
-                    if samples > 0:
-                        baseline_file = self.output_dir / f"baseline_noise_{int(time.time())}.csv"
-                        with open(baseline_file, 'w', newline='', encoding='utf-8') as f:
-                            writer = csv.writer(f)
-                            writer.writerow([
-                                'timestamp', 'sensor',
-                                'accel_x', 'accel_y', 'accel_z',
-                                'gyro_x', 'gyro_y', 'gyro_z',
-                                'rot_x', 'rot_y', 'rot_z', 'rot_w'
-                            ])
-                            for entry in self.noise_buffer:
-                                writer.writerow([
-                                    entry['timestamp'], entry['sensor'],
-                                    entry['accel_x'], entry['accel_y'], entry['accel_z'],
-                                    entry['gyro_x'], entry['gyro_y'], entry['gyro_z'],
-                                    entry['rot_x'], entry['rot_y'], entry['rot_z'], entry['rot_w']
-                                ])
-                        print(f"   💾 Baseline saved to {baseline_file.name}")
-
-                    print("✋ Ready for button presses...\n")
-
-            # If no button pressed (default NOISE state), continue collecting noise
-            elif self.active_recording is None and not self.skip_noise:
-                self.noise_buffer.append(sensor_entry)
+                # Baseline complete - save noise data immediately
+                self.baseline_noise_captured = True
+                samples = self.baseline_count
+                print(f"✅ Baseline noise captured ({samples} samples)")
+
+                # Queue baseline noise for saving (the writer thread now owns the arrays)
+                if samples > 0:
+                    baseline_file = self.output_dir / f"baseline_noise_{int(time.time())}.csv"
+                    baseline = (self.baseline_ts[:samples],
+                                self.baseline_sensor[:samples],
+                                self.baseline_values[:samples])
+                    self._queue_write(baseline_file, BASELINE_COLUMNS, baseline)
+                    print(f"   💾 Baseline queued for writing to {baseline_file.name}")
+                self.baseline_ts = self.baseline_sensor = self.baseline_values = None
+
+                print("✋ Ready for button presses...\n")
+
+        # If no button pressed (default NOISE state), continue collecting noise
+        elif self.active_recording is None and not self.skip_noise:
+            self._append_noise(timestamp, code, row)
+
+    def _append_baseline(self, timestamp, code, row):
+        """Append one sample to the baseline arrays, doubling their capacity when full"""
+        n = self.baseline_count
+        if n == len(self.baseline_ts):
+            grown = alloc_samples(2 * n)
+            for new, old in zip(grown, (self.baseline_ts, self.baseline_sensor, self.baseline_values)):
+                new[:n] = old
+            self.baseline_ts, self.baseline_sensor, self.baseline_values = grown
+
+        self.baseline_ts[n] = timestamp
+        self.baseline_sensor[n] = code
+        self.baseline_values[n] = row
+        self.baseline_count = n + 1
+
+    def _append_noise(self, timestamp, code, row):
+        """Append one sample to the current noise block, feeding the reservoirs when it fills"""
+        n = self.noise_pending
+        self.noise_ts[n] = timestamp
+        self.noise_sensor[n] = code
+        self.noise_values[n] = row
+        self.noise_pending = n + 1
+        self.noise_count += 1
+
+        if self.noise_pending == LOCOMOTION_SEGMENT:
+            block = (self.noise_ts, self.noise_sensor, self.noise_values)
+            self.locomotion_reservoir.offer(block)
+            for segment in zip(*self._segment_noise(block, duration_sec=1.0, samples_per_sec=50)):
+                self.action_reservoir.offer(segment)
+            self.noise_pending = 0
 
     def handle_label_event(self, msg, addr):
         """Handle label start/end events from button app"""
@@ -314,176 +645,196 @@ class ButtonDataCollector:
             return
 
         if event == 'start':
-            with self.lock:
-                if self.active_recording:
-                    print(f"⚠️  Already recording {self.active_recording['action']}, ignoring new start")
-                    return
-
-                self.active_recording = {
-                    'action': action,
-                    'start_time': timestamp,
-                    'start_index': len(self.sensor_buffer)
-                }
+            if self.active_recording:
+                print(f"⚠️  Already recording {self.active_recording['action']}, ignoring new start")
+                return
+
+            self.active_recording = {
+                'action': action,
+                'start_time': timestamp,
+                'start_index': self.widx
+            }
 
-                print(f"🔴 Recording {action.upper()} (from {addr[0]})")
+            print(f"🔴 Recording {action.upper()} (from {addr[0]})")
 
         elif event == 'end':
-            with self.lock:
-                if not self.active_recording:
-                    print(f"⚠️  No active recording to end")
-                    return
+            if not self.active_recording:
+                print(f"⚠️  No active recording to end")
+                return
 
-                if self.active_recording['action'] != action:
-                    print(f"⚠️  Mismatch: recording {self.active_recording['action']} but got end for {action}")
-                    return
+            if self.active_recording['action'] != action:
+                print(f"⚠️  Mismatch: recording {self.active_recording['action']} but got end for {action}")
+                return
 
-                # Calculate duration
-                duration_ms = timestamp - self.active_recording['start_time']
-                duration_sec = duration_ms / 1000.0
+            # Calculate duration
+            duration_ms = timestamp - self.active_recording['start_time']
+            duration_sec = duration_ms / 1000.0
 
-                # Save the recording
-                filename = self.save_recording(
-                    action=action,
-                    start_time=self.active_recording['start_time'],
-                    end_time=timestamp,
-                    count=msg.get('count', 0)
-                )
+            # Save the recording
+            filename = self.save_recording(
+                action=action,
+                start_time=self.active_recording['start_time'],
+                end_time=timestamp,
+                count=msg.get('count', 0)
+            )
 
-                # Update statistics
-                self.action_counts[action] = self.action_counts.get(action, 0) + 1
-                self.total_recordings += 1
+            # Update statistics
+            self.action_counts[action] = self.action_counts.get(action, 0) + 1
+            self.total_recordings += 1
 
-                count = msg.get('count', 0)
-                print(f"✅ Saved {action.upper()} ({duration_sec:.2f}s) → {filename} [Count: {count}]")
-                self.print_progress()
+            count = msg.get('count', 0)
+            print(f"✅ Saved {action.upper()} ({duration_sec:.2f}s) → {filename} [Count: {count}]")
+            self.print_progress()
 
-                self.active_recording = None
+            self.active_recording = None
 
     def save_recording(self, action, start_time, end_time, count):
-        """Save recording to CSV file"""
+        """Queue recording for saving to CSV file"""
         # Create filename
         filename = f"{action}_{start_time}_to_{end_time}.csv"
         filepath = self.output_dir / filename
 
         # Extract sensor data from buffer within time window
-        with self.lock:
-            # Convert millisecond timestamps to nanoseconds for comparison
-            start_ns = start_time * 1_000_000
-            end_ns = end_time * 1_000_000
-
-            # Filter sensor data within time window
-            recording_data = [
-                entry for entry in self.sensor_buffer
-                if start_ns <= entry['timestamp'] <= end_ns
-            ]
-
-        # Save to CSV with corrected column order (matches old format)
-        with open(filepath, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                'accel_x', 'accel_y', 'accel_z',
-                'gyro_x', 'gyro_y', 'gyro_z',
-                'rot_w', 'rot_x', 'rot_y', 'rot_z',
-                'sensor', 'timestamp'
-            ])
-
-            # Write sensor data with correct order
-            for entry in recording_data:
-                writer.writerow([
-                    entry['accel_x'], entry['accel_y'], entry['accel_z'],
-                    entry['gyro_x'], entry['gyro_y'], entry['gyro_z'],
-                    entry['rot_w'], entry['rot_x'], entry['rot_y'], entry['rot_z'],
-                    entry['sensor'],
-                    entry['timestamp']
-                ])
-
-        print(f"   💾 Saved {len(recording_data)} sensor samples to {filename}")
+        # Convert millisecond timestamps to nanoseconds for comparison
+        start_ns = start_time * 1_000_000
+        end_ns = end_time * 1_000_000
+
+        # Ring buffer contents oldest first: one slice until it wraps, then two
+        columns = (self.ring_ts, self.ring_sensor, self.ring)
+        if self.widx <= RING_N:
+            ts, codes, values = (col[:self.widx] for col in columns)
+        else:
+            split = self.widx & RING_MASK
+            ts, codes, values = (np.concatenate((col[split:], col[:split])) for col in columns)
+
+        # Boolean indexing copies, so the writer thread gets an immutable snapshot
+        in_window = (ts >= start_ns) & (ts <= end_ns)
+        recording_data = (ts[in_window], codes[in_window], values[in_window])
+
+        # Queue CSV write with corrected column order (matches old format)
+        self._queue_write(filepath, RECORDING_COLUMNS, recording_data)
+
+        print(f"   💾 Queued {len(recording_data[0])} sensor samples for writing to {filename}")
 
         return filename
 
     def segment_and_save_noise(self):
-        """Segment noise buffer into fixed-size chunks and save exactly 30 per classifier"""
-        import random
-
-        if not self.noise_buffer:
+        """Save the 30 reservoir-sampled noise segments per classifier"""
+        if self.noise_count == 0:
             print("⚠️  No noise data collected")
             return
 
-        print(f"\n🔇 Processing noise data ({len(self.noise_buffer)} samples)...")
-
-        # All samples should now be properly structured
-        valid_noise = self.noise_buffer
-
-        print(f"✅ Validated {len(valid_noise)} noise samples")
+        print(f"\n🔇 Processing noise data ({self.noise_count} samples)...")
 
-        # Segment for locomotion classifier (5-second chunks)
-        locomotion_segments = self._segment_noise(valid_noise, duration_sec=5.0, samples_per_sec=50)
+        # The unfinished 5s block can still yield 1s action segments
+        n = self.noise_pending
+        partial = (self.noise_ts[:n], self.noise_sensor[:n], self.noise_values[:n])
+        for segment in zip(*self._segment_noise(partial, duration_sec=1.0, samples_per_sec=50)):
+            self.action_reservoir.offer(segment)
+        self.noise_pending = 0
 
-        # Segment for action classifier (1-second chunks)
-        action_segments = self._segment_noise(valid_noise, duration_sec=1.0, samples_per_sec=50)
-
-        # Randomly select exactly 30 samples per classifier
-        if len(locomotion_segments) >= 30:
-            selected_locomotion = random.sample(locomotion_segments, 30)
-            print(f"📦 Selected 30 locomotion noise segments (5s each) from {len(locomotion_segments)} available")
+        # Reservoirs already hold a uniform random selection of at most 30 segments
+        selected_locomotion = self.locomotion_reservoir.segments()
+        available = self.locomotion_reservoir.seen
+        if available >= NOISE_SEGMENTS:
+            print(f"📦 Selected 30 locomotion noise segments (5s each) from {available} available")
         else:
-            selected_locomotion = locomotion_segments
-            print(f"⚠️  Only {len(locomotion_segments)} locomotion segments available (need 30)")
+            print(f"⚠️  Only {available} locomotion segments available (need 30)")
 
-        if len(action_segments) >= 30:
-            selected_action = random.sample(action_segments, 30)
-            print(f"📦 Selected 30 action noise segments (1s each) from {len(action_segments)} available")
+        selected_action = self.action_reservoir.segments()
+        available = self.action_reservoir.seen
+        if available >= NOISE_SEGMENTS:
+            print(f"📦 Selected 30 action noise segments (1s each) from {available} available")
         else:
-            selected_action = action_segments
-            print(f"⚠️  Only {len(action_segments)} action segments available (need 30)")
-
-        # Save locomotion noise segments
-        for i, segment in enumerate(selected_locomotion, 1):
-            filename = f"noise_locomotion_seg_{i:03d}.csv"
-            self._save_noise_segment(filename, segment)
+            print(f"⚠️  Only {available} action segments available (need 30)")
 
-        # Save action noise segments
-        for i, segment in enumerate(selected_action, 1):
-            filename = f"noise_action_seg_{i:03d}.csv"
-            self._save_noise_segment(filename, segment)
+        # Save all segments to a single file, one segment_id/classifier_type per row
+        tagged = ([('locomotion', i, seg) for i, seg in enumerate(selected_locomotion, 1)] +
+                  [('action', i, seg) for i, seg in enumerate(selected_action, 1)])
+        self._save_noise_segments(tagged)
 
-        self.action_counts['noise'] = len(selected_locomotion) + len(selected_action)
-        print(f"✅ Saved {self.action_counts['noise']} noise segments")
+        self.action_counts['noise'] = len(tagged)
+        print(f"✅ Saved {self.action_counts['noise']} noise segments to {NOISE_SEGMENTS_FILE}")
 
     def _segment_noise(self, noise_data, duration_sec, samples_per_sec):
-        """Segment noise data into fixed-duration chunks"""
+        """
+        Segment noise data (ts, sensor, values) into fixed-duration chunks.
+        Returns the same columns reshaped to (n_segments, segment_size, ...) views;
+        iterate zip(*result) for per-segment (ts, sensor, values). Any incomplete
+        trailing chunk is dropped.
+        """
         segment_size = int(duration_sec * samples_per_sec)
-        segments = []
-
-        for i in range(0, len(noise_data) - segment_size + 1, segment_size):
-            segment = noise_data[i:i + segment_size]
-            if len(segment) == segment_size:
-                segments.append(segment)
-
-        return segments
+        n_full = len(noise_data[0]) // segment_size
+        return tuple(
+            col[:n_full * segment_size].reshape(n_full, segment_size, *col.shape[1:])
+            for col in noise_data
+        )
+
+    def _save_noise_segments(self, tagged):
+        """Queue (classifier_type, segment_id, segment) noise segments for saving as one CSV"""
+        if not tagged:
+            return
 
-    def _save_noise_segment(self, filename, segment):
-        """Save a noise segment to CSV with corrected column order"""
-        filepath = self.output_dir / filename
+        samples = tuple(np.concatenate(cols) for cols in zip(*(seg for _, _, seg in tagged)))
+        extra = {'segment_id': [], 'classifier_type': []}
+        for kind, seg_id, seg in tagged:
+            n = len(seg[0])
+            extra['segment_id'] += [b'%d' % seg_id] * n
+            extra['classifier_type'] += [kind.encode('ascii')] * n
+
+        filepath = self.output_dir / NOISE_SEGMENTS_FILE
+        self._queue_write(filepath, NOISE_SEGMENT_COLUMNS, samples, extra)
+
+    def _queue_write(self, filepath, columns, samples, extra=None):
+        """Hand a CSV write to the writer thread (samples must not be modified afterwards)"""
+        # The writer gets its own snapshot of the code -> name table, which the
+        # receive thread keeps appending to
+        self.write_ring.push((filepath, columns, samples, extra, tuple(self.sensor_names)))
+
+    def _writer_loop(self):
+        """Writer thread: perform queued CSV writes until a None sentinel arrives"""
+        while True:
+            job = self.write_ring.pop()
+            if job is None:
+                break
+
+            filepath, columns, samples, extra, sensor_names = job
+            try:
+                with open(filepath, 'wb', buffering=1 << 16) as f:
+                    f.write(HEADER_BYTES[columns])
+                    f.writelines(self._sample_lines(columns, samples, sensor_names, extra))
+            except Exception as e:
+                # Keep the thread alive: a dead writer would block the next push forever
+                print(f"❌ Failed to write {filepath.name}: {e}")
+
+    def _sample_lines(self, columns, samples, sensor_names, extra=None):
+        """
+        Render (ts, sensor, values) column arrays as CSV lines (bytes) in the given
+        column order. sensor_names maps sensor codes to names; extra maps any other
+        column name to its pre-rendered bytes values.
+        """
+        ts, codes, values = samples
+        names = [csv_field(name) for name in sensor_names]
+        cols = []
+        for name in columns:
+            if extra and name in extra:
+                cols.append(extra[name])
+            elif name == 'timestamp':
+                cols.append([b'%d' % t for t in ts.tolist()])
+            elif name == 'sensor':
+                cols.append([names[c] for c in codes.tolist()])
+            else:
+                # %r gives the shortest round-trip float repr, same as csv.writer
+                cols.append([b'%r' % v for v in values[:, CHANNEL_INDEX[name]].tolist()])
+        return [b','.join(row) + b'\n' for row in zip(*cols)]
 
-        with open(filepath, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                'accel_x', 'accel_y', 'accel_z',
-                'gyro_x', 'gyro_y', 'gyro_z',
-                'rot_w', 'rot_x', 'rot_y', 'rot_z',
-                'sensor', 'timestamp'
-            ])
-
-            # Write actual sensor data with correct order
-            for entry in segment:
-                writer.writerow([
-                    entry['accel_x'], entry['accel_y'], entry['accel_z'],
-                    entry['gyro_x'], entry['gyro_y'], entry['gyro_z'],
-                    entry['rot_w'], entry['rot_x'], entry['rot_y'], entry['rot_z'],
-                    entry['sensor'],
-                    entry['timestamp']
-                ])
+    def stop_writer(self):
+        """Flush pending CSV writes and stop the writer thread"""
+        if self.writer_thread is None:
+            return
+        self.write_ring.push(None)
+        self.writer_thread.join()
+        self.writer_thread = None
 
     def print_progress(self):
         """Print current collection progress"""
@@ -517,7 +868,14 @@ def main():
     # Parse command line arguments
     skip_noise = '--skip-noise' in sys.argv
 
-    collector = ButtonDataCollector(skip_noise=skip_noise)
+    pin_cpu = None
+    if '--pin-cpu' in sys.argv:
+        pin_cpu = DEFAULT_PIN_CPU
+        idx = sys.argv.index('--pin-cpu') + 1
+        if idx < len(sys.argv) and sys.argv[idx].isdigit():
+            pin_cpu = int(sys.argv[idx])
+
+    collector = ButtonDataCollector(skip_noise=skip_noise, pin_cpu=pin_cpu)
 
     print("""
 ╔═══════════════════════════════════════════════════════════╗
@@ -533,6 +891,7 @@ Instructions:
 
 Options:
   --skip-noise    Skip baseline noise capture (for testing)
+  --pin-cpu [N]   Pin UDP receive thread to CPU N (Linux, default 2)
 
 Press Ctrl+C to stop and see statistics.
 """)